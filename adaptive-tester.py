@@ -5,24 +5,86 @@ Learns from each test failure and adapts the approach
 """
 
 import asyncio
+import collections
 import json
 import time
 from datetime import datetime
-from playwright.async_api import async_playwright
+from urllib.parse import urlencode
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError, async_playwright
+from browser_pool import close_browser, get_browser
+from tester_config import (
+    ADAPTIVE_AMOUNT_PATTERN, DEBUG_SCREENSHOTS, MAX_PARALLEL_STRATEGIES, PROVIDER_PATTERN, STRATEGIES, TMP
+)
+
+# Strategies that need storage no earlier strategy has touched get a fresh context
+ISOLATED_STRATEGIES = {"iframe"}
+
+# Origins whose site storage is wiped before a worker context is reused
+# (js/simple-main.js leaves provider preferences in localStorage)
+STORAGE_ORIGINS = ("https://blinds123.github.io", "https://simpleswap.io", "https://www.simpleswap.io")
+
+# Requests that carry nothing for hijack detection (CSS/JS/XHR are always kept)
+# Blocked inside the browser via CDP, so matching requests never reach Python
+BLOCKED_URL_PATTERNS = [
+    "*google-analytics.com*", "*segment.io*", "*doubleclick.net*", "*sentry.io*", "*hotjar.com*",
+    # File types are anchored to the end of the path or the start of the query string,
+    # so a script such as /js/jquery.webp-polyfill.js still loads
+    "*.png", "*.png?*", "*.jpg", "*.jpg?*", "*.jpeg", "*.jpeg?*",
+    "*.gif", "*.gif?*", "*.webp", "*.webp?*",
+    "*.woff", "*.woff?*", "*.woff2", "*.woff2?*", "*.ttf", "*.ttf?*", "*.otf", "*.otf?*",
+    "*.mp4", "*.mp4?*", "*.webm", "*.webm?*", "*.mp3", "*.mp3?*",
+]
+
+# In-page scan: matching input values plus amount/provider flags from the page text.
+# One alternation pass over the text replaces four separate substring scans.
+SCAN_JS = r"""({amountPattern, providerPattern}) => {
+    const t = document.body ? document.body.innerText : '';
+    const amount = new RegExp(amountPattern);
+    const needles = new RegExp(`(?:${amountPattern})|(?:${providerPattern})`, 'gi');
+    const found = new Set((t.match(needles) || []).map(m => m.toLowerCase()));
+    const seen = prefix => [...found].some(m => m.startsWith(prefix));
+    return {
+        inputs: [...document.querySelectorAll('input')]
+            .map(i => i.value)
+            .filter(v => amount.test(v)),
+        amt19: seen('19.5'),
+        amt21: seen('21.42'),
+        merc: found.has('mercuryo'),
+        moon: found.has('moonpay')
+    };
+}"""
+
+# Predicate for wait_for_function: the scan result once the hijacked amount shows up.
+# 19.5 alone is not enough - the hijack is 19.5 turning into 21.42 later on.
+WAIT_FOR_HIJACK_JS = """(needles) => {
+    const hit = (""" + SCAN_JS + """)(needles);
+    return (hit.amt21 || hit.inputs.some(v => v.includes('21.42'))) ? hit : false;
+}"""
+
+# Arguments for SCAN_JS and WAIT_FOR_HIJACK_JS
+SCAN_NEEDLES = {"amountPattern": ADAPTIVE_AMOUNT_PATTERN, "providerPattern": PROVIDER_PATTERN}
 
 class AdaptiveSimpleSwapTester:
     def __init__(self):
         self.base_url = "https://blinds123.github.io/simpleswap-realtime-test"
-        self.strategies = [
-            "basic", "withProvider", "buyInterface", "fixedRate", 
-            "withWallet", "buySell", "allLocks", "altCurrency", 
-            "directMercuryo", "iframe"
-        ]
+        self.strategies = STRATEGIES
+        self.strategy_urls = {
+            strategy: f"{self.base_url}?{urlencode({'strategy': strategy})}"
+            for strategy in STRATEGIES
+        }
         self.results = []
-        self.learned_insights = []
+        self.learned_insights = collections.deque(maxlen=500)
+        self._insight_seen = set()
+        self._success_count = 0
+        self._fail_count = 0
+        self._js_error_fail_count = 0
+        self._out = None
         
     def log_insight(self, insight):
-        """Log a learned insight"""
+        """Log a learned insight (each distinct insight is kept once)"""
+        if insight in self._insight_seen:
+            return
+        self._insight_seen.add(insight)
         timestamp = datetime.now().isoformat()
         self.learned_insights.append({
             "timestamp": timestamp,
@@ -30,6 +92,26 @@ class AdaptiveSimpleSwapTester:
         })
         print(f"🧠 LEARNED: {insight}")
     
+    def write_record(self, kind, record):
+        """Append one typed JSONL record and flush it to disk straight away"""
+        if self._out:
+            self._out.write(json.dumps({"type": kind, **record}) + "\n")
+            self._out.flush()
+    
+    def record_result(self, result):
+        """Keep a result and append it to the JSONL results file straight away"""
+        self.results.append(result)
+        
+        # Running counters so pattern analysis never rescans past results
+        if result.get("success"):
+            self._success_count += 1
+        else:
+            self._fail_count += 1
+            if result.get("had_js_errors"):
+                self._js_error_fail_count += 1
+        
+        self.write_record("result", result)
+    
     async def wait_for_cache_update(self, strategy_index):
         """Wait progressively longer for cache updates"""
         if strategy_index < 3:
@@ -56,93 +138,127 @@ class AdaptiveSimpleSwapTester:
         
         return findings
     
-    async def test_strategy_with_learning(self, browser, strategy, attempt=1):
-        """Test a strategy with adaptive learning"""
-        print(f"\n🧪 Testing strategy: {strategy} (attempt {attempt})")
-        
-        context = await browser.new_context()
+    @staticmethod
+    def format_console_logs(messages, last=None):
+        """Format buffered console messages, optionally only the last few"""
+        messages = list(messages)
+        if last:
+            messages = messages[-last:]
+        return [f"[{msg.type}] {msg.text}" for msg in messages]
+    
+    async def reset_context(self, context):
+        """Clear cookies, permissions and site storage, keeping the HTTP cache warm"""
+        await context.clear_cookies()
+        await context.clear_permissions()
         page = await context.new_page()
+        try:
+            cdp = await context.new_cdp_session(page)
+            for origin in STORAGE_ORIGINS:
+                await cdp.send("Storage.clearDataForOrigin", {
+                    "origin": origin,
+                    "storageTypes": "local_storage,indexeddb,service_workers,cache_storage"
+                })
+        finally:
+            await page.close()
+    
+    @staticmethod
+    async def block_noise(page):
+        """Abort trackers and heavy media for this page, let everything else through"""
+        cdp = await page.context.new_cdp_session(page)
+        await cdp.send("Network.enable")
+        await cdp.send("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+    
+    async def test_strategy_with_learning(self, context, strategy, max_attempts=2):
+        """Test a strategy with adaptive learning, retrying in the same page"""
+        page = await context.new_page()
+        await self.block_noise(page)
         
-        # Set up console monitoring
-        console_logs = []
+        # Set up console monitoring (raw messages in a ring buffer, formatted later)
+        console_logs = collections.deque(maxlen=200)
+        error_logs = collections.deque(maxlen=10)  # Errors picked out once, as they arrive
         def log_console(msg):
-            console_logs.append(f"[{msg.type}] {msg.text}")
+            console_logs.append(msg)
+            if msg.type == "error" or "error" in msg.text.lower():
+                error_logs.append(f"[{msg.type}] {msg.text}")
         
         page.on("console", log_console)
         
+        url = self.strategy_urls[strategy]
+        
         try:
-            # Navigate with cache busting
-            cache_buster = int(time.time())
-            url = f"{self.base_url}?strategy={strategy}&t={cache_buster}"
-            print(f"📍 Navigating to: {url}")
-            
-            await page.goto(url, wait_until="networkidle", timeout=30000)
-            
-            # Wait for app initialization
-            await page.wait_for_selector("#buy-button", timeout=15000)
-            await self.wait_for_cache_update(len(self.results))
-            
-            # Check for debug output (learning point)
-            debug_output = await page.query_selector("#debug-output")
-            if debug_output:
-                debug_text = await debug_output.text_content()
-                print(f"🐛 Debug found: {debug_text[:100]}...")
-                self.log_insight(f"Debug output present in {strategy}")
-            else:
-                self.log_insight(f"No debug output in {strategy} - may indicate loading issue")
-            
-            # Monitor for JavaScript errors before clicking
-            js_errors = [log for log in console_logs if "error" in log.lower()]
-            if js_errors:
-                self.log_insight(f"Pre-click JS errors in {strategy}: {js_errors[-1]}")
-            
-            print("🖱️ Clicking buy button...")
-            await page.click("#buy-button")
-            
-            # Wait and monitor for changes
-            await asyncio.sleep(3)
-            
-            # Check if we stayed on same page or redirected
-            current_url = page.url
-            if current_url == url:
-                self.log_insight(f"No redirect occurred in {strategy} - checking for errors")
+            for attempt in range(1, max_attempts + 1):
+                print(f"\n🧪 Testing strategy: {strategy} (attempt {attempt})")
+                print(f"📍 Navigating to: {url}")
+                console_logs.clear()
+                error_logs.clear()
+                js_scope_error = False
                 
-                # Analyze console logs for failure reason
-                findings = await self.analyze_console_logs(console_logs)
-                for finding in findings:
-                    self.log_insight(finding)
+                await page.goto(url, wait_until="domcontentloaded", timeout=30000)
                 
-                # Check if it's a JavaScript error we can learn from
-                recent_errors = [log for log in console_logs[-5:] if "error" in log.lower()]
-                if recent_errors:
-                    error_text = recent_errors[-1]
-                    if "workingUrl is not defined" in error_text:
-                        self.log_insight("JavaScript variable scope issue detected")
-                        
-                        # Try to fix by waiting longer and retry
-                        if attempt < 2:
-                            print("🔄 Retrying with longer wait...")
-                            await context.close()
-                            await asyncio.sleep(5)
-                            return await self.test_strategy_with_learning(browser, strategy, attempt + 1)
+                # Wait for app initialization
+                await page.wait_for_selector("#buy-button", state="visible", timeout=15000)
+                await self.wait_for_cache_update(len(self.results))
                 
-                success = False
-                notes = ["No redirect occurred", "Checking console logs for cause"]
+                # Check for debug output (learning point) - lookup and text in one call
+                debug_texts = await page.eval_on_selector_all("#debug-output", "els => els.map(e => e.textContent || '')")
+                if debug_texts:
+                    print(f"🐛 Debug found: {debug_texts[0][:100]}...")
+                    self.log_insight(f"Debug output present in {strategy}")
+                else:
+                    self.log_insight(f"No debug output in {strategy} - may indicate loading issue")
                 
-            elif "simpleswap.io" in current_url:
-                print("✅ Successfully redirected to SimpleSwap")
-                self.log_insight(f"Successful redirect with {strategy}")
-                success = True
-                notes = ["Successful redirect"]
+                # Monitor for JavaScript errors before clicking
+                if error_logs:
+                    self.log_insight(f"Pre-click JS errors in {strategy}: {error_logs[-1]}")
                 
-                # Monitor SimpleSwap page for hijacking
-                await self.monitor_simpleswap_with_learning(page, strategy)
+                print("🖱️ Clicking buy button...")
                 
-            else:
-                print(f"🤔 Unexpected redirect to: {current_url}")
-                self.log_insight(f"Unexpected redirect in {strategy}: {current_url}")
-                success = False
-                notes = [f"Unexpected redirect to {current_url}"]
+                # Resolve as soon as the redirect commits instead of a fixed wait
+                try:
+                    async with page.expect_navigation(timeout=8000, wait_until="domcontentloaded"):
+                        await page.click("#buy-button")
+                    redirected = True
+                except PlaywrightTimeoutError:
+                    redirected = False
+                
+                # Check if we stayed on same page or redirected
+                current_url = page.url
+                if not redirected or current_url == url:
+                    self.log_insight(f"No redirect occurred in {strategy} - checking for errors")
+                    
+                    # Analyze console logs for failure reason
+                    logs = self.format_console_logs(console_logs)
+                    findings = await self.analyze_console_logs(logs)
+                    for finding in findings:
+                        self.log_insight(finding)
+                    
+                    # Check if it's a JavaScript error we can learn from
+                    if any("workingUrl is not defined" in log for log in error_logs):
+                        self.log_insight("JavaScript variable scope issue detected")
+                        js_scope_error = True
+                    
+                    success = False
+                    notes = ["No redirect occurred", "Checking console logs for cause"]
+                
+                elif "simpleswap.io" in current_url:
+                    print("✅ Successfully redirected to SimpleSwap")
+                    self.log_insight(f"Successful redirect with {strategy}")
+                    success = True
+                    notes = ["Successful redirect"]
+                    
+                    # Monitor SimpleSwap page for hijacking
+                    await self.monitor_simpleswap_with_learning(page, strategy)
+                
+                else:
+                    print(f"🤔 Unexpected redirect to: {current_url}")
+                    self.log_insight(f"Unexpected redirect in {strategy}: {current_url}")
+                    success = False
+                    notes = [f"Unexpected redirect to {current_url}"]
+                
+                # Only a JavaScript scope error is worth a fresh load
+                if success or not js_scope_error or attempt == max_attempts:
+                    break
+                print("🔄 Retrying...")
             
             # Collect comprehensive results
             result = {
@@ -151,28 +267,30 @@ class AdaptiveSimpleSwapTester:
                 "timestamp": datetime.now().isoformat(),
                 "success": success,
                 "final_url": current_url,
-                "console_logs": console_logs[-10:],
+                "console_logs": self.format_console_logs(console_logs, last=10),
+                "had_js_errors": bool(error_logs),
                 "notes": notes
             }
             
-            self.results.append(result)
+            self.record_result(result)
             
         except Exception as e:
             print(f"❌ Error testing {strategy}: {e}")
             self.log_insight(f"Exception in {strategy}: {str(e)}")
             
-            self.results.append({
+            self.record_result({
                 "strategy": strategy,
                 "attempt": attempt,
                 "timestamp": datetime.now().isoformat(),
                 "success": False,
                 "error": str(e),
-                "console_logs": console_logs[-5:] if console_logs else [],
+                "console_logs": self.format_console_logs(console_logs, last=5),
+                "had_js_errors": bool(error_logs),
                 "notes": ["Exception occurred"]
             })
         
         finally:
-            await context.close()
+            await page.close()
     
     async def monitor_simpleswap_with_learning(self, page, strategy):
         """Monitor SimpleSwap with adaptive learning"""
@@ -181,44 +299,43 @@ class AdaptiveSimpleSwapTester:
         amount_found = False
         provider_found = False
         
-        # Look for amount changes over time
-        for i in range(15):  # Monitor for 15 seconds
-            await asyncio.sleep(1)
-            
-            # Check for amount displays
+        try:
+            # Resolve early only on a hijack; otherwise watch the full window, then scan once
             try:
-                # Method 1: Check input values
-                inputs = await page.query_selector_all("input")
-                for inp in inputs:
-                    value = await inp.input_value() if inp else ""
-                    if value and ("19.5" in value or "21.42" in value):
-                        print(f"💰 Amount input: {value}")
-                        amount_found = True
-                        if "21.42" in value:
-                            self.log_insight(f"Amount hijack detected in {strategy}: {value}")
-                
-                # Method 2: Check text content
-                page_text = await page.content()
-                if "19.5" in page_text or "21.42" in page_text:
-                    if not amount_found:
-                        print(f"💰 Amount in page text found")
-                        amount_found = True
-                    if "21.42" in page_text:
-                        self.log_insight(f"Amount hijack in page text for {strategy}")
-                
-                # Method 3: Check for provider elements
-                if "mercuryo" in page_text.lower():
-                    provider_found = True
-                    print(f"🏦 Mercuryo found in page")
-                
-                if "moonpay" in page_text.lower():
-                    print(f"🏦 Moonpay found in page")
-                    if provider_found:
-                        self.log_insight(f"Provider competition detected in {strategy}")
-                
-            except Exception as e:
-                print(f"⚠️ Monitoring error: {e}")
-                continue
+                handle = await page.wait_for_function(
+                    WAIT_FOR_HIJACK_JS, arg=SCAN_NEEDLES, polling=250, timeout=15000
+                )
+                hit = await handle.json_value()
+            except PlaywrightTimeoutError:
+                hit = await page.evaluate(SCAN_JS, SCAN_NEEDLES)  # Final scrape picks up late amounts and providers
+            
+            # Method 1: Check input values
+            for value in hit["inputs"]:
+                print(f"💰 Amount input: {value}")
+                amount_found = True
+                if "21.42" in value:
+                    self.log_insight(f"Amount hijack detected in {strategy}: {value}")
+            
+            # Method 2: Check text content
+            if hit["amt19"] or hit["amt21"]:
+                if not amount_found:
+                    print(f"💰 Amount in page text found")
+                    amount_found = True
+                if hit["amt21"]:
+                    self.log_insight(f"Amount hijack in page text for {strategy}")
+            
+            # Method 3: Check for provider elements
+            if hit["merc"]:
+                provider_found = True
+                print(f"🏦 Mercuryo found in page")
+            
+            if hit["moon"]:
+                print(f"🏦 Moonpay found in page")
+                if provider_found:
+                    self.log_insight(f"Provider competition detected in {strategy}")
+            
+        except Exception as e:
+            print(f"⚠️ Monitoring error: {e}")
         
         # Learning summary
         if amount_found:
@@ -229,78 +346,111 @@ class AdaptiveSimpleSwapTester:
         if provider_found:
             self.log_insight(f"Provider detection successful in {strategy}")
         
-        # Take screenshot for analysis
-        screenshot_path = f"/tmp/simpleswap_{strategy}_{int(time.time())}.png"
-        await page.screenshot(path=screenshot_path, full_page=True)
-        print(f"📸 Full page screenshot: {screenshot_path}")
+        # Viewport JPEG for analysis, only when something needs a look
+        if not amount_found or DEBUG_SCREENSHOTS:
+            screenshot_path = TMP / f"simpleswap_{strategy}_{int(time.time())}.jpg"
+            await page.screenshot(path=screenshot_path, full_page=False, type="jpeg", quality=70)
+            print(f"📸 Screenshot: {screenshot_path}")
     
     async def run_adaptive_tests(self):
         """Run all tests with adaptive learning"""
         print("🚀 Starting adaptive SimpleSwap testing with learning...")
         
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=False)
-            
-            for i, strategy in enumerate(self.strategies):
-                print(f"\n{'='*60}")
-                print(f"🧪 TESTING STRATEGY {i+1}/{len(self.strategies)}: {strategy}")
-                print(f"{'='*60}")
-                
-                await self.test_strategy_with_learning(browser, strategy)
-                
-                # Learn from previous results
-                if i > 0:
-                    self.analyze_patterns()
-                
-                # Adaptive delay based on results (shorter for faster testing)
-                if i < len(self.strategies) - 1:
-                    await asyncio.sleep(2)
-            
-            await browser.close()
+        # Results are streamed as JSONL so a crash keeps everything recorded so far
+        results_file = TMP / f"adaptive_results_{int(time.time())}.jsonl"
+        self._out = open(results_file, 'a')
         
-        # Save comprehensive results
-        results_file = f"/tmp/adaptive_results_{int(time.time())}.json"
-        with open(results_file, 'w') as f:
-            json.dump({
-                "results": self.results,
-                "insights": self.learned_insights,
-                "analysis": self.final_analysis()
-            }, f, indent=2)
+        try:
+            async with async_playwright() as p:
+                browser = await get_browser(p)
+                
+                try:
+                    # Long-lived worker contexts keep the HTTP cache warm between strategies
+                    contexts = asyncio.Queue()
+                    for _ in range(MAX_PARALLEL_STRATEGIES):
+                        contexts.put_nowait(await browser.new_context())
+                    
+                    # One failing worker must not tear the browser down under the others
+                    outcomes = await asyncio.gather(*[
+                        self._run_one(browser, contexts, i, strategy)
+                        for i, strategy in enumerate(self.strategies)
+                    ], return_exceptions=True)
+                    for strategy, outcome in zip(self.strategies, outcomes):
+                        if isinstance(outcome, Exception):
+                            print(f"❌ Worker for {strategy} failed: {outcome}")
+                finally:
+                    await close_browser()
+        finally:
+            # Insights and the analysis follow the results, one record per line
+            for insight in self.learned_insights:
+                self.write_record("insight", insight)
+            self.write_record("analysis", self.final_analysis())
+            self._out.close()
+            self._out = None
         
         print(f"\n📊 Comprehensive results saved to: {results_file}")
         self.print_adaptive_summary()
     
+    async def _run_one(self, browser, contexts, index, strategy):
+        """Test one strategy once a worker context is free"""
+        context = await contexts.get()
+        try:
+            print(f"\n{'='*60}")
+            print(f"🧪 TESTING STRATEGY {index+1}/{len(self.strategies)}: {strategy}")
+            print(f"{'='*60}")
+            
+            if strategy in ISOLATED_STRATEGIES:
+                isolated = await browser.new_context()
+                try:
+                    await self.test_strategy_with_learning(isolated, strategy)
+                finally:
+                    await isolated.close()
+            else:
+                await self.test_strategy_with_learning(context, strategy)
+                try:
+                    await self.reset_context(context)
+                except Exception as e:
+                    # Swap a broken worker context for a fresh one instead of failing the run
+                    print(f"⚠️ Context reset failed after {strategy}: {e}")
+                    try:
+                        await context.close()
+                    except Exception:
+                        pass
+                    context = await browser.new_context()
+            
+            # Learn from previous results
+            if len(self.results) > 1:
+                self.analyze_patterns()
+        finally:
+            contexts.put_nowait(context)
+    
     def analyze_patterns(self):
         """Analyze patterns from previous tests"""
-        successful_strategies = [r for r in self.results if r.get("success")]
-        failed_strategies = [r for r in self.results if not r.get("success")]
-        
-        if successful_strategies:
-            success_pattern = f"Found {len(successful_strategies)} successful strategies"
+        if self._success_count:
+            success_pattern = f"Found {self._success_count} successful strategies"
             self.log_insight(success_pattern)
         
-        if failed_strategies:
+        if self._fail_count:
             # Look for common failure patterns
-            js_error_count = sum(1 for r in failed_strategies if any("error" in log.lower() for log in r.get("console_logs", [])))
-            if js_error_count > 0:
-                self.log_insight(f"JavaScript errors in {js_error_count} strategies - code issue")
+            if self._js_error_fail_count > 0:
+                self.log_insight(f"JavaScript errors in {self._js_error_fail_count} strategies - code issue")
     
     def final_analysis(self):
         """Provide final analysis and recommendations"""
         analysis = {
             "total_tests": len(self.results),
-            "successful": len([r for r in self.results if r.get("success")]),
-            "failed": len([r for r in self.results if not r.get("success")]),
+            "successful": self._success_count,
+            "failed": self._fail_count,
             "key_insights": [],
             "recommendations": []
         }
         
         # Extract key insights
-        if "JavaScript variable scope issue detected" in [i["insight"] for i in self.learned_insights]:
+        if "JavaScript variable scope issue detected" in self._insight_seen:
             analysis["key_insights"].append("JavaScript variable scoping needs fixing")
             analysis["recommendations"].append("Fix workingUrl variable initialization")
         
-        if "CSP blocks iframe embedding" in [i["insight"] for i in self.learned_insights]:
+        if "CSP blocks iframe embedding" in self._insight_seen:
             analysis["key_insights"].append("Iframe approach blocked by CSP")
             analysis["recommendations"].append("Use popup window instead of iframe")
         
@@ -325,7 +475,7 @@ class AdaptiveSimpleSwapTester:
                 print(f"  - {result['strategy']}: {result['final_url']}")
         
         print("\n🧠 Key insights learned:")
-        for insight in self.learned_insights[-10:]:  # Show last 10 insights
+        for insight in list(self.learned_insights)[-10:]:  # Show last 10 insights
             print(f"  - {insight['insight']}")
         
         # Analysis
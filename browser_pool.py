@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Shared Chromium pool for the SimpleSwap testers
+Keeps one warm browser alive between runs and reconnects to it over CDP
+
+Every tester attaches to the same browser as a CDP client and works in its
+own contexts. Point testers at an existing browser with
+PLAYWRIGHT_CDP_ENDPOINT, or run this module to start one and print it.
+Stop the pooled browser with `browser_pool.py --stop`.
+"""
+
+import asyncio
+import fcntl
+import os
+import signal
+import socket
+import subprocess
+import sys
+from pathlib import Path
+from playwright.async_api import Error as PlaywrightError, async_playwright
+from tester_config import TMP
+
+CDP_PORT = 9222
+CDP_ENDPOINT = os.environ.get("PLAYWRIGHT_CDP_ENDPOINT", f"http://127.0.0.1:{CDP_PORT}")
+
+# Headless unless HEADED=1 (only applies when this process starts the browser)
+HEADED = os.environ.get("HEADED") == "1"
+HEADLESS_ARGS = ["--headless=new", "--disable-gpu", "--no-sandbox", "--disable-dev-shm-usage"]
+
+# One fixed profile and pidfile, so the pool only ever owns a single browser
+POOL_DIR = TMP / "simpleswap_browser"
+PROFILE_DIR = POOL_DIR / "profile"
+PID_FILE = POOL_DIR / "chromium.pid"
+LOCK_FILE = POOL_DIR / "pool.lock"
+
+_browser = None
+_sigterm_installed = False
+
+def _pool_pid():
+    """PID of the pool's own Chromium, or None (dropping a stale pidfile) if it is not running"""
+    try:
+        pid = int(PID_FILE.read_text())
+    except (OSError, ValueError):
+        return None
+    # The pid may have been reused - only trust a process running on our profile
+    try:
+        cmdline = (Path("/proc") / str(pid) / "cmdline").read_bytes()
+    except OSError:
+        cmdline = b""
+    if str(PROFILE_DIR).encode() not in cmdline:
+        PID_FILE.unlink(missing_ok=True)
+        return None
+    return pid
+
+def _port_in_use():
+    """True if something is already listening on the CDP port"""
+    try:
+        with socket.create_connection(("127.0.0.1", CDP_PORT), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+async def _connect(p, timeout=2000):
+    """Attach to the warm browser, or return None if nothing is listening"""
+    try:
+        return await p.chromium.connect_over_cdp(CDP_ENDPOINT, timeout=timeout)
+    except PlaywrightError:
+        return None
+
+def _launch_detached(p):
+    """Start Chromium outside Playwright so it outlives this process"""
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    args = [
+        p.chromium.executable_path,
+        f"--remote-debugging-port={CDP_PORT}",
+        f"--user-data-dir={PROFILE_DIR}",
+        "--no-first-run",
+        "--no-default-browser-check",
+    ]
+    if not HEADED:
+        args += HEADLESS_ARGS
+    proc = subprocess.Popen(
+        args + ["about:blank"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    PID_FILE.write_text(str(proc.pid))
+
+async def _wait_for_cdp(p):
+    """Connect to the pooled browser, giving a just-started one time to listen"""
+    for _ in range(20):  # Wait up to ~10 seconds for CDP to come up
+        browser = await _connect(p)
+        if browser:
+            return browser
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Pooled browser did not expose CDP at {CDP_ENDPOINT}")
+
+async def _attach_or_launch(p):
+    """Reuse the pool's browser or start it - call only while holding LOCK_FILE"""
+    if _pool_pid():
+        browser = await _wait_for_cdp(p)
+        print(f"♻️ Reusing warm browser at {CDP_ENDPOINT}")
+        return browser
+    if _port_in_use():
+        # Not ours (e.g. a developer's own Chrome) - don't drive it
+        raise RuntimeError(f"Port {CDP_PORT} is taken by a browser this pool did not start")
+    print(f"🚀 Launching browser with CDP at {CDP_ENDPOINT}")
+    _launch_detached(p)
+    return await _wait_for_cdp(p)
+
+async def get_browser(p):
+    """Return the shared browser, launching it on first use"""
+    global _browser, _sigterm_installed
+    if _browser and _browser.is_connected():
+        return _browser
+
+    # Make SIGTERM unwind through the testers' finally blocks (only once a tester uses the pool)
+    if not _sigterm_installed:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(128 + signal.SIGTERM))
+        _sigterm_installed = True
+
+    if "PLAYWRIGHT_CDP_ENDPOINT" in os.environ:
+        # Someone else owns this browser - never launch a second one behind it
+        _browser = await _connect(p)
+        if not _browser:
+            raise RuntimeError(f"No browser listening at PLAYWRIGHT_CDP_ENDPOINT={CDP_ENDPOINT}")
+        return _browser
+
+    # Testers starting together take turns, so only one of them ever launches Chromium
+    POOL_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOCK_FILE, "w") as lock:
+        await asyncio.to_thread(fcntl.flock, lock, fcntl.LOCK_EX)
+        _browser = await _attach_or_launch(p)
+    return _browser
+
+async def close_browser():
+    """Disconnect from the shared browser, leaving it warm for the next run"""
+    global _browser
+    if _browser:
+        await _browser.close()
+        _browser = None
+
+def stop_browser():
+    """Terminate the pooled browser and forget its pidfile"""
+    pid = _pool_pid()
+    if pid:
+        os.kill(pid, signal.SIGTERM)
+        print(f"🛑 Stopped pooled browser (pid {pid})")
+    else:
+        print("ℹ️ No pooled browser running")
+    PID_FILE.unlink(missing_ok=True)
+
+async def _serve():
+    """Start (or find) the shared browser and print its endpoint"""
+    async with async_playwright() as p:
+        await get_browser(p)
+        print(f"export PLAYWRIGHT_CDP_ENDPOINT={CDP_ENDPOINT}")
+        await close_browser()
+
+if __name__ == "__main__":
+    if "--stop" in sys.argv[1:]:
+        stop_browser()
+    else:
+        asyncio.run(_serve())
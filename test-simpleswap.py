@@ -5,19 +5,25 @@ Tests all URL strategies and monitors for amount/provider hijacking
 """
 
 import asyncio
+import collections
 import json
 import time
 from datetime import datetime
-from playwright.async_api import async_playwright
+from urllib.parse import urlencode
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError, async_playwright
+from browser_pool import close_browser, get_browser
+from tester_config import (
+    AMOUNT_PATTERN, DEBUG_SCREENSHOTS, MAX_PARALLEL_STRATEGIES, PROVIDER_PATTERN, STRATEGIES, TMP, VERBOSE
+)
 
 class SimpleSwapTester:
     def __init__(self):
         self.base_url = "https://blinds123.github.io/simpleswap-realtime-test"
-        self.strategies = [
-            "basic", "withProvider", "buyInterface", "fixedRate", 
-            "withWallet", "buySell", "allLocks", "altCurrency", 
-            "directMercuryo", "iframe"
-        ]
+        self.strategies = STRATEGIES
+        self.strategy_urls = {
+            strategy: f"{self.base_url}?{urlencode({'strategy': strategy})}"
+            for strategy in STRATEGIES
+        }
         self.results = []
         
     async def test_strategy(self, browser, strategy):
@@ -29,35 +35,36 @@ class SimpleSwapTester:
         
         try:
             # Navigate to the testing page with specific strategy
-            url = f"{self.base_url}?strategy={strategy}"
+            url = self.strategy_urls[strategy]
             print(f"📍 Navigating to: {url}")
             
-            await page.goto(url, wait_until="networkidle")
+            await page.goto(url, wait_until="domcontentloaded", timeout=30000)
             
             # Wait for app to initialize
-            await page.wait_for_selector("#buy-button", timeout=10000)
+            await page.wait_for_selector("#buy-button", state="visible", timeout=10000)
             await asyncio.sleep(2)
             
-            # Check if debug output is visible
-            debug_output = await page.query_selector("#debug-output")
-            if debug_output:
-                debug_text = await debug_output.text_content()
-                print(f"🐛 Debug output: {debug_text[:200]}...")
+            # Check if debug output is visible - lookup and text in one call
+            debug_texts = await page.eval_on_selector_all("#debug-output", "els => els.map(e => e.textContent || '')")
+            if debug_texts:
+                print(f"🐛 Debug output: {debug_texts[0][:200]}...")
             
             # Monitor console logs
-            console_logs = []
+            console_logs = collections.deque(maxlen=200)
             def log_console(msg):
-                console_logs.append(f"[{msg.type}] {msg.text}")
-                print(f"📋 Console: [{msg.type}] {msg.text}")
+                console_logs.append(msg)
+                if VERBOSE:
+                    print(f"📋 Console: [{msg.type}] {msg.text}")
             
             page.on("console", log_console)
             
             # Click the buy button
             print("🖱️ Clicking buy button...")
-            await page.click("#buy-button")
             
             # Wait for redirect or iframe
             if strategy == "iframe":
+                await page.click("#buy-button")
+                
                 # Look for iframe creation
                 await asyncio.sleep(3)
                 iframe_container = await page.query_selector("div[style*='position: fixed']")
@@ -76,11 +83,18 @@ class SimpleSwapTester:
                                 print("✅ Iframe content accessible")
                                 # Look for amount displays
                                 await asyncio.sleep(5)
-                                amount_elements = await iframe_content.query_selector_all("*")
-                                for element in amount_elements[:20]:  # Check first 20 elements
-                                    text = await element.text_content() or ""
-                                    if "19.50" in text or "21.42" in text:
-                                        print(f"💰 Amount found: {text}")
+                                # Scan the first 20 elements in-frame, only matches come back
+                                matches = await iframe_content.evaluate("""({limit, pattern}) => {
+                                    const amount = new RegExp(pattern);
+                                    const out = [];
+                                    for (const e of [...document.querySelectorAll('*')].slice(0, limit)) {
+                                        const t = (e.textContent || '').trim();
+                                        if (amount.test(t)) out.push(t.slice(0, 80));
+                                    }
+                                    return out;
+                                }""", {"limit": 20, "pattern": AMOUNT_PATTERN})
+                                for text in matches:
+                                    print(f"💰 Amount found: {text}")
                         except Exception as e:
                             print(f"❌ Iframe content blocked: {e}")
                     else:
@@ -88,16 +102,20 @@ class SimpleSwapTester:
                 else:
                     print("❌ No iframe overlay created")
             else:
-                # Wait for redirect
-                await asyncio.sleep(2)
+                # Wait for redirect, resolving as soon as navigation commits
+                try:
+                    async with page.expect_navigation(timeout=8000, wait_until="domcontentloaded"):
+                        await page.click("#buy-button")
+                except PlaywrightTimeoutError:
+                    pass
                 current_url = page.url
                 print(f"🔄 Current URL: {current_url}")
                 
                 if "simpleswap.io" in current_url:
                     print("✅ Successfully redirected to SimpleSwap")
                     
-                    # Wait for page to load
-                    await page.wait_for_load_state("networkidle", timeout=15000)
+                    # Wait for the first amount-bearing field rather than network idle
+                    await page.wait_for_selector("input", timeout=5000)
                     
                     # Monitor for amount changes
                     print("👀 Monitoring for amount changes...")
@@ -112,7 +130,7 @@ class SimpleSwapTester:
                 "timestamp": datetime.now().isoformat(),
                 "success": "simpleswap.io" in page.url or strategy == "iframe",
                 "final_url": page.url,
-                "console_logs": console_logs[-10:],  # Last 10 logs
+                "console_logs": [f"[{msg.type}] {msg.text}" for msg in list(console_logs)[-10:]],  # Last 10 logs
                 "notes": []
             }
             
@@ -133,71 +151,77 @@ class SimpleSwapTester:
         finally:
             await context.close()
     
+    async def _run_one(self, browser, strategy, sem):
+        """Test one strategy once a parallel slot is free"""
+        async with sem:
+            await self.test_strategy(browser, strategy)
+    
     async def monitor_simpleswap_page(self, page, strategy):
         """Monitor SimpleSwap page for amount and provider changes"""
         print("🔍 Monitoring SimpleSwap page for hijacking...")
         
-        # Look for amount displays
-        amount_checks = [
-            "input[type='text']", "input[type='number']", 
-            "*[class*='amount']", "*[class*='price']", "*[class*='value']"
-        ]
+        amount_found = False
         
         for i in range(10):  # Monitor for 10 seconds
             await asyncio.sleep(1)
             
-            # Check for amount values
-            for selector in amount_checks:
-                elements = await page.query_selector_all(selector)
-                for element in elements:
-                    try:
-                        # Check input value
-                        value = await element.input_value() if await element.get_attribute("type") in ["text", "number"] else None
-                        if value and ("19.50" in value or "21.42" in value):
-                            print(f"💰 Amount input found: {value} (selector: {selector})")
-                        
-                        # Check text content
-                        text = await element.text_content() or ""
-                        if "19.50" in text or "21.42" in text:
-                            print(f"💰 Amount text found: {text} (selector: {selector})")
-                            
-                    except Exception as e:
-                        continue
+            # Scan amount and provider elements in-page, one round-trip per poll
+            hits = await page.evaluate("""({amountPattern, providerPattern}) => {
+                const amount = new RegExp(amountPattern);
+                const provider = new RegExp(providerPattern, 'i');
+                const out = [];
+                document.querySelectorAll("input[type='text'], input[type='number']").forEach(i => {
+                    if (amount.test(i.value)) out.push({kind: 'input', v: i.value});
+                });
+                document.querySelectorAll("[class*='amount'], [class*='price'], [class*='value']").forEach(e => {
+                    const t = e.textContent || '';
+                    if (amount.test(t)) out.push({kind: 'txt', v: t.slice(0, 80)});
+                });
+                [...document.querySelectorAll('*')].slice(0, 100).forEach(e => {
+                    const t = e.textContent || '';
+                    if (provider.test(t)) {
+                        out.push({kind: 'provider', v: t.slice(0, 50), cls: e.getAttribute('class') || ''});
+                    }
+                });
+                return out;
+            }""", {"amountPattern": AMOUNT_PATTERN, "providerPattern": PROVIDER_PATTERN})
             
-            # Check for provider elements
-            provider_elements = await page.query_selector_all("*")
-            for element in provider_elements[:100]:  # Check first 100 elements
-                try:
-                    text = await element.text_content() or ""
-                    if "mercuryo" in text.lower() or "moonpay" in text.lower():
-                        classes = await element.get_attribute("class") or ""
-                        print(f"🏦 Provider found: {text[:50]} (classes: {classes})")
-                except Exception as e:
-                    continue
+            for hit in hits:
+                if hit["kind"] == "input":
+                    print(f"💰 Amount input found: {hit['v']}")
+                    amount_found = True
+                elif hit["kind"] == "txt":
+                    print(f"💰 Amount text found: {hit['v']}")
+                    amount_found = True
+                else:
+                    print(f"🏦 Provider found: {hit['v']} (classes: {hit['cls']})")
             
             print(f"⏰ Monitoring... {i+1}/10")
         
-        # Take screenshot for manual review
-        screenshot_path = f"/tmp/simpleswap_{strategy}_{int(time.time())}.png"
-        await page.screenshot(path=screenshot_path)
-        print(f"📸 Screenshot saved: {screenshot_path}")
+        # Take screenshot for manual review when no amount was found
+        if not amount_found or DEBUG_SCREENSHOTS:
+            screenshot_path = TMP / f"simpleswap_{strategy}_{int(time.time())}.jpg"
+            await page.screenshot(path=screenshot_path, type="jpeg", quality=70)
+            print(f"📸 Screenshot saved: {screenshot_path}")
     
     async def run_all_tests(self):
         """Run all strategy tests"""
         print("🚀 Starting comprehensive SimpleSwap testing...")
         
         async with async_playwright() as p:
-            # Launch browser
-            browser = await p.chromium.launch(headless=False)  # headless=False to see what's happening
-            
-            for strategy in self.strategies:
-                await self.test_strategy(browser, strategy)
-                await asyncio.sleep(2)  # Brief pause between tests
+            # Reuse the warm browser from the pool (HEADED=1 to see what's happening)
+            browser = await get_browser(p)
             
-            await browser.close()
+            try:
+                sem = asyncio.Semaphore(MAX_PARALLEL_STRATEGIES)
+                await asyncio.gather(*[
+                    self._run_one(browser, strategy, sem) for strategy in self.strategies
+                ])
+            finally:
+                await close_browser()
         
         # Save results
-        results_file = f"/tmp/simpleswap_results_{int(time.time())}.json"
+        results_file = TMP / f"simpleswap_results_{int(time.time())}.json"
         with open(results_file, 'w') as f:
             json.dump(self.results, f, indent=2)
         
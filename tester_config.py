@@ -0,0 +1,33 @@
+"""
+Settings shared by the SimpleSwap testers
+Both testers and the browser pool import these so they cannot drift apart
+"""
+
+import os
+from pathlib import Path
+
+# URL strategies exercised on every run
+STRATEGIES = (
+    "basic", "withProvider", "buyInterface", "fixedRate",
+    "withWallet", "buySell", "allLocks", "altCurrency",
+    "directMercuryo", "iframe"
+)
+
+# Strategies tested concurrently
+MAX_PARALLEL_STRATEGIES = 4
+
+# Screenshots, result files and the pooled browser profile land here
+TMP = Path("/tmp")
+
+# Screenshot every strategy, not just the ones where no amount showed up (DEBUG_SCREENSHOTS=1)
+DEBUG_SCREENSHOTS = os.environ.get("DEBUG_SCREENSHOTS") == "1"
+
+# Echo every console message as it arrives (VERBOSE=1)
+VERBOSE = os.environ.get("VERBOSE") == "1"
+
+# Needles for the in-page scans, passed to page.evaluate() and compiled in the browser.
+# 19.50 is the honest amount, 21.42 the hijacked one.
+AMOUNT_PATTERN = r"19\.50|21\.42"
+# The adaptive tester deliberately matches any amount starting 19.5 (19.5, 19.50, ...)
+ADAPTIVE_AMOUNT_PATTERN = r"19\.5|21\.42"
+PROVIDER_PATTERN = r"mercuryo|moonpay"